@@ -5,7 +5,7 @@
 # This script demonstrates how to create an MCP (Model Context Protocol) server
 # from an AI Agent. The agent exposes food recipe search functionality through MCP.
 #
-# SETUP: Install packages: pip install agent-framework openai mcp requests python-dotenv anyio pydantic
+# SETUP: Install packages: pip install agent-framework openai mcp "httpx[http2,brotli]" python-dotenv anyio msgspec tenacity uvloop
 # .env file: OPENROUTER_ENDPOINT=https://openrouter.ai/api/v1, OPENROUTER_API_KEY=your_key
 #
 # CLAUDE DESKTOP CONFIG: Add to claude_desktop_config.json:
@@ -20,17 +20,23 @@
 # ========================================================================
 
 import asyncio
+import importlib.util
+import logging
 import os
-import json
-import requests
-from typing import Annotated, List, Dict, Any, Optional, Callable, Awaitable
-from pydantic import Field
+import sys
+import sqlite3
+import threading
+import time
+import httpx
+import msgspec
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+from typing import List, Dict, Any, Optional, Callable, Awaitable
 from dotenv import load_dotenv, find_dotenv
 import anyio
 
 # Core components for building Agent, tool-enabled agents
 # Ensure you have installed: pip install -U agent-framework --pre
-from agent_framework import ChatAgent, AgentRunContext, FunctionInvocationContext
+from agent_framework import ChatAgent, AgentRunContext, FunctionInvocationContext, AIFunction
 from agent_framework.openai import OpenAIChatClient
 from mcp.server.stdio import stdio_server
 
@@ -41,36 +47,145 @@ from mcp.server.stdio import stdio_server
 # functions here following the same pattern with proper docstrings and type hints.
 # ========================================================================
 
+# Logger for tool calls and cache issues. stdout carries the MCP JSON-RPC frames, so logs go to stderr.
+# Set the level to logging.DEBUG to see each call.
+logger = logging.getLogger("food_agent")
+logger.addHandler(logging.StreamHandler(sys.stderr))
+
+# Shared async HTTP client: keeps one warm HTTP/2 connection to TheMealDB across
+# tool calls, multiplexes concurrent requests on it, and never blocks the event
+# loop that drives the MCP stdio server. Closed in run() on shutdown.
+# httpx advertises br in Accept-Encoding by itself once brotli is installed (see SETUP).
+_http = httpx.AsyncClient(
+    base_url="https://www.themealdb.com",
+    http2=True,
+    timeout=httpx.Timeout(5.0, connect=2.0),
+    limits=httpx.Limits(max_keepalive_connections=10, max_connections=20)
+)
+
+# Circuit breaker: after 5 consecutive failed requests, fail fast for 30 seconds
+# instead of waiting on MealDB timeouts during an outage
+_BREAKER_THRESHOLD = 5
+_BREAKER_COOLDOWN = 30.0
+_breaker = {"fails": 0, "opened_at": 0.0}
+
+class MealDBUnavailableError(Exception):
+    """Raised when the circuit breaker is open or a call exceeds its time budget."""
+
+# Only network errors and 5xx responses are worth retrying
+def _is_transient(exc: BaseException) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500
+    return isinstance(exc, httpx.TransportError)
+
+# Failures that say MealDB itself is unhealthy or rate-limiting us; other client
+# errors (e.g. 404) don't trip the breaker
+def _trips_breaker(exc: BaseException) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError) and exc.response.status_code == 429:
+        return True
+    return _is_transient(exc)
+
+# httpx timeouts apply per phase (connect, each read, ...), not per request, so
+# _get_mealdb enforces a hard budget on the whole call including retries
+_MEALDB_CALL_BUDGET = 15.0
+
+# Up to 3 attempts with jittered backoff
+@retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential_jitter(initial=0.1, max=1.0, jitter=0.1),
+    retry=retry_if_exception(_is_transient),
+    reraise=True
+)
+async def _request_mealdb(path: str, params: Optional[Dict[str, str]]) -> httpx.Response:
+    response = await _http.get(path, params=params)
+    response.raise_for_status()
+    return response
+
+async def _get_mealdb(path: str, params: Optional[Dict[str, str]] = None) -> httpx.Response:
+    if (_breaker["fails"] >= _BREAKER_THRESHOLD
+            and time.monotonic() - _breaker["opened_at"] < _BREAKER_COOLDOWN):
+        raise MealDBUnavailableError("TheMealDB is temporarily unavailable, try again shortly.")
+    try:
+        response = await asyncio.wait_for(_request_mealdb(path, params), timeout=_MEALDB_CALL_BUDGET)
+    except (httpx.HTTPError, asyncio.TimeoutError) as e:
+        timed_out = isinstance(e, asyncio.TimeoutError)
+        if timed_out or _trips_breaker(e):
+            _breaker["fails"] += 1
+            if _breaker["fails"] >= _BREAKER_THRESHOLD:
+                _breaker["opened_at"] = time.monotonic()
+        if timed_out:
+            raise MealDBUnavailableError(f"TheMealDB did not respond within {_MEALDB_CALL_BUDGET:.0f}s.") from e
+        raise
+    _breaker["fails"] = 0
+    return response
+
+# MealDB exposes up to 20 numbered ingredient/measure slots per meal
+_ING_KEYS = tuple((f"strIngredient{i}", f"strMeasure{i}") for i in range(1, 21))
+
+# Typed view of the MealDB response listing only the fields we use: msgspec skips
+# every other key (thumbnails, sources, dates, ...) without building Python objects
+_MEAL_FIELDS = ("idMeal", "strMeal", "strCategory", "strArea", "strInstructions", "strTags", "strYoutube")
+_RawMeal = msgspec.defstruct(
+    "_RawMeal",
+    [(field, Optional[str], None) for field in _MEAL_FIELDS + sum(_ING_KEYS, ())]
+)
+
+class _MealDBResponse(msgspec.Struct):
+    meals: Optional[List[_RawMeal]] = None
+
+# Decoder and encoder are built once and reused for every tool call
+_decoder = msgspec.json.Decoder(_MealDBResponse)
+_encoder = msgspec.json.Encoder()
+
+# Prebuilt payloads for the miss paths, which LLMs hit often with made-up dish names.
+# Only the JSON-escaped message is encoded per call for the not-found case.
+_NO_MEAL = _encoder.encode({"error": "No meal found."}).decode()
+_NOT_FOUND_TEMPLATE = '{"status":"not_found","message":%s}'
+
+# Clean, LLM-friendly meal record; msgspec encodes Structs straight to JSON
+class Meal(msgspec.Struct):
+    id: Optional[str]
+    name: Optional[str]
+    category: Optional[str]
+    area: Optional[str]
+    instructions: Optional[str]
+    ingredients: List[str]
+    tags: Optional[str]
+    youtube_link: Optional[str]
+
 # Helper to transform raw API response into clean, LLM-friendly format
-def _clean_meal_data(meal: Dict[str, Any]) -> Dict[str, Any]:
+def _clean_meal_data(meal: _RawMeal) -> Optional[Meal]:
     """
     Helper function to restructure the raw meal API response into a clean,
     LLM-friendly format by combining ingredients and measures.
     """
     if not meal:
-        return {}
+        return None
 
     # Combine ingredients and measures into a single list
     ingredients = []
-    for i in range(1, 21):
-        ing = meal.get(f"strIngredient{i}")
-        measure = meal.get(f"strMeasure{i}")
-        if ing and ing.strip():
-            ingredients.append(f"{measure.strip()} {ing.strip()}".strip())
-
-    return {
-        "id": meal.get("idMeal"),
-        "name": meal.get("strMeal"),
-        "category": meal.get("strCategory"),
-        "area": meal.get("strArea"),
-        "instructions": meal.get("strInstructions"),
-        "ingredients": ingredients,
-        "tags": meal.get("strTags"),
-        "youtube_link": meal.get("strYoutube")
-    }
+    # Skip empty slots rather than stopping at the first one, in case a meal has gaps
+    for ing_key, meas_key in _ING_KEYS:
+        ing = (getattr(meal, ing_key) or "").strip()
+        if not ing:
+            continue
+        # Strip each value once; the measure may be null or blank
+        measure = (getattr(meal, meas_key) or "").strip()
+        ingredients.append(f"{measure} {ing}" if measure else ing)
+
+    return Meal(
+        id=meal.idMeal,
+        name=meal.strMeal,
+        category=meal.strCategory,
+        area=meal.strArea,
+        instructions=meal.strInstructions,
+        ingredients=ingredients,
+        tags=meal.strTags,
+        youtube_link=meal.strYoutube
+    )
 
 # Tool: Get random meal from TheMealDB API
-def get_random_meal() -> str:
+async def get_random_meal() -> str:
     """
     Retrieves a random meal recipe from the database.
     Useful when the user wants a surprise suggestion or explicitly asks for a random recommendation.
@@ -79,23 +194,146 @@ def get_random_meal() -> str:
         str: A JSON string containing the meal name, ingredients, and cooking instructions.
     """
     try:
-        response = requests.get("https://www.themealdb.com/api/json/v1/1/random.php")
-        response.raise_for_status()
-        data = response.json()
+        response = await _get_mealdb("/api/json/v1/1/random.php")
+        meals = _decoder.decode(response.content).meals
 
-        if not data.get("meals"):
-            return json.dumps({"error": "No meal found."})
+        if not meals:
+            return _NO_MEAL
 
-        meal = _clean_meal_data(data["meals"][0])
-        return json.dumps(meal, indent=2)
+        meal = _clean_meal_data(meals[0])
+        return _encoder.encode(meal).decode()
 
     except Exception as e:
-        return json.dumps({"error": f"Failed to fetch random meal: {str(e)}"})
+        return _encoder.encode({"error": f"Failed to fetch random meal: {str(e)}"}).decode()
+
+# Persistent cache for named lookups: MealDB recipes are effectively immutable,
+# so hits survive server restarts. Misses and random meals are not cached.
+_CACHE_PATH = os.path.expanduser("~/.cache/food_agent.sqlite")
+_CACHE_KEEP_RECORDS = 1000
+# Format of the cached payloads: bump whenever Meal or _clean_meal_data output
+# changes, so entries written by older code are dropped on the next start
+_CACHE_VERSION = 2
+# Short busy timeout so a locked cache file can't add seconds to a tool call
+_CACHE_BUSY_TIMEOUT = 0.2
+
+def _init_cache(conn: sqlite3.Connection) -> None:
+    if conn.execute("PRAGMA user_version").fetchone()[0] != _CACHE_VERSION:
+        conn.execute("DROP TABLE IF EXISTS meal_search")
+        conn.execute(f"PRAGMA user_version = {_CACHE_VERSION:d}")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS meal_search ("
+        "query TEXT PRIMARY KEY, payload TEXT NOT NULL, created_at REAL NOT NULL)"
+    )
+    # Trim on startup so the cache file stays bounded
+    conn.execute(
+        "DELETE FROM meal_search WHERE query NOT IN "
+        "(SELECT query FROM meal_search ORDER BY created_at DESC LIMIT ?)",
+        (_CACHE_KEEP_RECORDS,)
+    )
+    conn.commit()
+
+# Returns None (and the server runs uncached) if the cache can't be opened,
+# e.g. ~/.cache is unwritable or another process holds a lock on the file
+def _open_cache() -> Optional[sqlite3.Connection]:
+    conn = None
+    try:
+        os.makedirs(os.path.dirname(_CACHE_PATH), exist_ok=True)
+        conn = sqlite3.connect(_CACHE_PATH, timeout=_CACHE_BUSY_TIMEOUT, check_same_thread=False)
+        _init_cache(conn)
+        return conn
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("Meal search cache disabled, could not open %s: %s", _CACHE_PATH, e)
+        if conn is not None:
+            conn.close()
+        return None
+
+_cache_db = _open_cache()
+_cache_lock = threading.Lock()
+
+def _cache_get(query: str) -> Optional[str]:
+    if _cache_db is None:
+        return None
+    with _cache_lock:
+        row = _cache_db.execute("SELECT payload FROM meal_search WHERE query = ?", (query,)).fetchone()
+    return row[0] if row else None
+
+def _cache_put(query: str, payload: str) -> None:
+    if _cache_db is None:
+        return
+    with _cache_lock:
+        _cache_db.execute(
+            "INSERT OR REPLACE INTO meal_search (query, payload, created_at) VALUES (?, ?, julianday('now'))",
+            (query, payload)
+        )
+        _cache_db.commit()
+
+# Returns the encoded matches, or None when MealDB has no meal with that name
+async def _fetch_meals(query: str) -> Optional[str]:
+    # The API requires a search query parameter 's' (httpx handles URL-encoding)
+    response = await _get_mealdb("/api/json/v1/1/search.php", params={"s": query})
+    meals = _decoder.decode(response.content).meals
+
+    if not meals:
+        return None
+
+    # Clean and limit results (e.g., top 3 matches to save tokens)
+    results = [_clean_meal_data(m) for m in meals[:3]]
+    return _encoder.encode(results).decode()
+
+async def _lookup_meals(query: str) -> str:
+    # SQLite work runs in a thread so disk I/O never stalls the event loop.
+    # Cache reads and writes are best-effort: on any SQLite error, use the network.
+    try:
+        payload = await asyncio.to_thread(_cache_get, query)
+    except sqlite3.Error as e:
+        logger.warning("Could not read cached meal search %r: %s", query, e)
+        payload = None
+    if payload is None:
+        payload = await _fetch_meals(query)
+        if payload is None:
+            # Misses are not persisted: the dish may be added to MealDB later
+            return _NOT_FOUND_TEMPLATE % _encoder.encode(f"No meals found with the name '{query}'.").decode()
+        try:
+            await asyncio.to_thread(_cache_put, query, payload)
+        except sqlite3.Error as e:
+            logger.warning("Could not cache meal search %r: %s", query, e)
+    return payload
+
+# In-flight lookups by query: concurrent identical calls share one request.
+# Errors propagate to every waiter and are not cached.
+_inflight: Dict[str, "asyncio.Task[str]"] = {}
+
+def _finish_lookup(query: str, task: "asyncio.Task[str]") -> None:
+    _inflight.pop(query, None)
+    # Retrieve the exception so a lookup whose waiters were all cancelled
+    # doesn't log "Task exception was never retrieved"
+    if not task.cancelled():
+        task.exception()
+
+async def _search_meals(query: str) -> str:
+    task = _inflight.get(query)
+    if task is None:
+        task = asyncio.ensure_future(_lookup_meals(query))
+        _inflight[query] = task
+        task.add_done_callback(lambda t: _finish_lookup(query, t))
+    # Shield so one cancelled caller doesn't cancel the lookup for the others
+    return await asyncio.shield(task)
+
+# Hand-written parameter schema for get_meal_by_name, passed to AIFunction as its
+# input_model so the schema doesn't depend on pydantic Field metadata on the signature
+_MEAL_BY_NAME_PARAMETERS = {
+    "type": "object",
+    "properties": {
+        "meal_name": {
+            "type": "string",
+            "description": "The name of the meal to search for (e.g., 'Arrabiata', 'Burger')."
+        }
+    },
+    "required": ["meal_name"]
+}
 
 # Tool: Get meal by name from TheMealDB API
-def get_meal_by_name(
-    meal_name: Annotated[str, Field(description="The name of the meal to search for (e.g., 'Arrabiata', 'Burger').")]
-) -> str:
+async def get_meal_by_name(meal_name: str) -> str:
     """
     Searches for a specific meal recipe by name.
     Use this when the user asks for a specific dish or wants to know how to cook a named item.
@@ -107,20 +345,11 @@ def get_meal_by_name(
         str: A JSON string containing a list of matching meals with their details.
     """
     try:
-        # The API requires a search query parameter 's'
-        response = requests.get(f"https://www.themealdb.com/api/json/v1/1/search.php?s={meal_name}")
-        response.raise_for_status()
-        data = response.json()
-
-        if not data.get("meals"):
-            return json.dumps({"status": "not_found", "message": f"No meals found with the name '{meal_name}'."})
-
-        # Clean and limit results (e.g., top 3 matches to save tokens)
-        results = [_clean_meal_data(m) for m in data["meals"][:3]]
-        return json.dumps(results, indent=2)
+        # Normalize so "Burger" and "burger " hit the same cache entry
+        return await _search_meals(meal_name.strip().lower())
 
     except Exception as e:
-        return json.dumps({"error": f"Failed to search for meal: {str(e)}"})
+        return _encoder.encode({"error": f"Failed to search for meal: {str(e)}"}).decode()
 
 
 # ========================================================================
@@ -168,17 +397,50 @@ async def logging_function_middleware(
     next: Callable[[FunctionInvocationContext], Awaitable[None]],
 ) -> None:
     """Middleware that logs function calls."""
-    print(f"Calling function: {context.function.name}")
+    logger.debug("Calling function: %s", context.function.name)
     await next(context)
-    print(f"Function result: {context.result}")
+    # Guard so the (possibly multi-KB) result is only measured when debugging
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Function result: %s (%d chars)", context.function.name, len(str(context.result)))
+
+# The MCP server already reads frames in one loop and starts a task for each
+# request, so the reader stays hot. Cap concurrent agent runs so slow LLM
+# responses apply back-pressure instead of piling up unbounded work.
+# (asyncio.Semaphore binds to the running loop lazily, so module scope is fine.)
+MAX_CONCURRENT_RUNS = 8
+_run_slots = asyncio.Semaphore(MAX_CONCURRENT_RUNS)
+
+# Middleware to bound concurrent agent runs
+async def concurrency_limit_middleware(
+    context: AgentRunContext,
+    next: Callable[[AgentRunContext], Awaitable[None]],
+) -> None:
+    """Middleware that limits how many agent runs execute at once."""
+    async with _run_slots:
+        await next(context)
+
+# Tools exposed to the agent. get_meal_by_name is built explicitly so it can use
+# the hand-written parameter schema above.
+FOOD_TOOLS = [
+    get_random_meal,
+    AIFunction(
+        name="get_meal_by_name",
+        description=get_meal_by_name.__doc__ or "",
+        func=get_meal_by_name,
+        input_model=_MEAL_BY_NAME_PARAMETERS
+    )
+]
 
 # Create the Food Agent with tools and middleware
 food_agent = ChatAgent(
     name=AGENT_NAME,
     chat_client=openai_chat_client,
     instructions=AGENT_INSTRUCTIONS,
-    tools=[get_random_meal, get_meal_by_name],
-    middleware=[logging_function_middleware]
+    tools=FOOD_TOOLS,
+    # Let the model emit several tool calls per turn (e.g. "suggest two recipes");
+    # the framework runs them concurrently, which is safe as both tools are read-only
+    allow_multiple_tool_calls=True,
+    middleware=[concurrency_limit_middleware, logging_function_middleware]
 )
 
 # ========================================================================
@@ -189,6 +451,10 @@ food_agent = ChatAgent(
 # ========================================================================
 
 # Convert the agent to an MCP server object
+# Note: the MCP server runs the agent non-streaming, so tool calls are only
+# dispatched once the model's full message has arrived. Speculatively starting
+# get_meal_by_name from partially streamed arguments therefore has nothing to
+# hook into here; repeated names are instead served from the lookup cache.
 server = food_agent.as_mcp_server()
 
 async def run():
@@ -196,15 +462,20 @@ async def run():
     Run the MCP server using stdio transport.
     This allows the agent to communicate with MCP clients (like Claude Desktop).
     """
-    async with stdio_server() as (read_stream, write_stream):
-        await server.run(
-            read_stream,
-            write_stream,
-            server.create_initialization_options()
-        )
+    try:
+        async with stdio_server() as (read_stream, write_stream):
+            await server.run(
+                read_stream,
+                write_stream,
+                server.create_initialization_options()
+            )
+    finally:
+        await _http.aclose()
 
 if __name__ == "__main__":
+    # uvloop speeds up the stdio frame loop and HTTP I/O; it isn't available on Windows
+    use_uvloop = sys.platform != "win32" and importlib.util.find_spec("uvloop") is not None
     try:
-        anyio.run(run)
+        anyio.run(run, backend="asyncio", backend_options={"use_uvloop": use_uvloop})
     except KeyboardInterrupt:
         pass
\ No newline at end of file